@@ -1,17 +1,39 @@
 import os
-import json
+import re
+import sys
+import asyncio
+import threading
+import itertools
+from collections import deque
 from dotenv import load_dotenv
-from openai import OpenAI
+import orjson
+import httpx
+from cachetools import TTLCache
+from openai import AsyncOpenAI
 from ddgs import DDGS
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# one long-lived HTTP client so every request reuses the same keep-alive (HTTP/2) connection
+_http = httpx.AsyncClient(
+    http2=True,
+    timeout=60,
+    limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=180),
+)
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=_http)
 
 # -----------------------------
 # Settings
 # -----------------------------
 MODEL = "gpt-4o-mini"
-MAX_TURNS_TO_KEEP = 12  # 12 turns = 24 messages (user+assistant). Adjust as you like.
+MAX_TURNS_TO_KEEP = 12  # hard cap: 12 turns = 24 messages (user+assistant). Adjust as you like.
+MAX_TOKENS = 6000  # approx. token budget for the history sent to the model. Adjust as you like.
+SNIPPET_MAX_CHARS = 280  # web_search snippets are cut to this length
+
+# messages trimmed from history are folded into a short summary (appended to the system message)
+SUMMARY_HEADER = "Earlier in this conversation (summary):"
+SUMMARY_MAX_LINES = 20
+URL_RE = re.compile(r"https?://[^\s\"'<>)\]]+")
+SENTENCE_RE = re.compile(r"(.+?[.!?])(?=\s|$)")
 
 SYSTEM = (
     "You are a helpful assistant. "
@@ -41,102 +63,267 @@ TOOLS = [
 # -----------------------------
 # Tool implementation
 # -----------------------------
+# recent searches, so repeated tool queries don't hit the network again.
+# web_search runs in worker threads, hence the lock
+_SEARCH_CACHE: TTLCache = TTLCache(maxsize=256, ttl=600)
+_SEARCH_LOCK = threading.Lock()
+
+# one reusable DDGS client per worker thread: no per-call client setup,
+# and concurrent searches (asyncio.gather) never share an instance
+_DDGS_LOCAL = threading.local()
+
+def get_ddgs() -> DDGS:
+    ddgs = getattr(_DDGS_LOCAL, "ddgs", None)
+    if ddgs is None:
+        ddgs = _DDGS_LOCAL.ddgs = DDGS()
+    return ddgs
+
 def web_search(query: str, max_results: int = 5) -> list[dict]:
+    key = (query, max_results)
+    with _SEARCH_LOCK:
+        cached = _SEARCH_CACHE.get(key)
+    if cached is not None:
+        return [dict(r) for r in cached]
+
+    # compact results: every token here is paid for again in the second LLM call
     results = []
-    with DDGS() as ddgs:
-        for r in ddgs.text(query, max_results=max_results):
-            results.append(
-                {
-                    "title": r.get("title"),
-                    "url": r.get("href"),
-                    "snippet": r.get("body"),
-                }
-            )
+    seen: set[str] = set()
+    hits = get_ddgs().text(query, max_results=max_results)
+    for r in itertools.islice(hits, max_results):
+        url = (r.get("href") or "").strip()
+        if not url or url in seen:
+            continue
+        seen.add(url)
+        item = {"url": url}
+        title = (r.get("title") or "").strip()
+        if title:
+            item["title"] = title
+        snippet = " ".join((r.get("body") or "").split())[:SNIPPET_MAX_CHARS]
+        if snippet:
+            item["snippet"] = snippet
+        results.append(item)
+
+    with _SEARCH_LOCK:
+        _SEARCH_CACHE[key] = tuple(dict(r) for r in results)
     return results
 
+async def web_search_async(query: str, max_results: int = 5) -> list[dict]:
+    # DDGS is blocking, so run it in a worker thread to let searches overlap
+    return await asyncio.to_thread(web_search, query, max_results)
+
 # -----------------------------
 # Memory helpers
 # -----------------------------
-def trim_history(history: list[dict]) -> list[dict]:
+def approx_tokens(m: dict) -> int:
+    # cheap token estimate (~4 chars per token), no tokenizer needed
+    return (len(m.get("content") or "") + len(m.get("role", ""))) // 4
+
+def first_sentence(text: str, limit: int = 160) -> str:
+    text = " ".join(text.split())
+    m = SENTENCE_RE.match(text)
+    return (m.group(1) if m else text)[:limit]
+
+def heuristic_summary(msgs: list[dict]) -> str:
+    """
+    No-LLM summary of trimmed messages: first sentence of each user/assistant
+    message plus the URLs found in tool outputs, as bullet lines.
+    """
+    lines = []
+    urls: dict[str, None] = {}
+    for m in msgs:
+        content = m.get("content") or ""
+        if m["role"] == "user" and content.strip():
+            lines.append(f"- user asked: {first_sentence(content)}")
+        elif m["role"] == "assistant" and content.strip():
+            lines.append(f"- assistant answered: {first_sentence(content)}")
+        elif m["role"] == "tool":
+            urls.update(dict.fromkeys(URL_RE.findall(content)))
+    if urls:
+        lines.append("- sources: " + ", ".join(urls))
+    return "\n".join(lines)
+
+def merge_summary(old: str | None, new_lines: str) -> str:
+    lines = old.splitlines()[1:] if old else []
+    for line in new_lines.splitlines():
+        if line not in lines:
+            lines.append(line)
+    return "\n".join([SUMMARY_HEADER] + lines[-SUMMARY_MAX_LINES:])
+
+def new_history() -> tuple[dict, deque]:
+    """
+    Memory = (system message, deque of the recent messages).
+    The deque's maxlen caps the message count; appends evict in O(1).
+    """
+    return {"role": "system", "content": SYSTEM}, deque(maxlen=MAX_TURNS_TO_KEEP * 2)
+
+def remember(history: tuple[dict, deque], *msgs: dict):
     """
-    Keep system + last MAX_TURNS_TO_KEEP turns.
-    A 'turn' = (user + assistant). So keep 2*MAX_TURNS_TO_KEEP messages.
+    Appends messages to memory, then drops the oldest ones until the history
+    fits MAX_TOKENS (the latest is always kept). Everything that falls out is
+    summarized into the system message instead of being forgotten.
     """
-    # history[0] is system
-    if len(history) <= 1:
-        return history
+    system_msg, recent = history
+    evicted = []
+    for m in msgs:
+        if len(recent) == recent.maxlen:
+            evicted.append(recent.popleft())
+        recent.append(m)
 
-    max_msgs = 1 + (MAX_TURNS_TO_KEEP * 2)
-    if len(history) > max_msgs:
-        # Keep system + last messages
-        return [history[0]] + history[-(max_msgs - 1):]
-    return history
+    total = approx_tokens(system_msg) + sum(approx_tokens(m) for m in recent)
+    # also don't start on a tool result whose tool-call message was dropped
+    while len(recent) > 1 and (total > MAX_TOKENS or recent[0]["role"] == "tool"):
+        m = recent.popleft()
+        total -= approx_tokens(m)
+        evicted.append(m)
+
+    new_lines = heuristic_summary(evicted)
+    if new_lines:
+        old = system_msg["content"][len(SYSTEM):].strip() or None
+        system_msg["content"] = SYSTEM + "\n\n" + merge_summary(old, new_lines)
+
+def history_messages(history: tuple[dict, deque]) -> list[dict]:
+    # request payload: one walk over the deque, no slicing
+    system_msg, recent = history
+    return [system_msg, *recent]
 
 # -----------------------------
 # Chat with tools + memory
 # -----------------------------
-def chat_with_tools(history: list[dict], user_input: str) -> str:
+async def stream_completion(**kwargs) -> dict:
+    """
+    Streams a completion, echoing text to stdout as it arrives, and rebuilds
+    the final assistant message from the deltas as a plain dict: role, content
+    and -- only if the model called tools -- the minimal tool_calls list.
+    It can go straight back into the history without any SDK conversion.
+    """
+    parts: list[str] = []
+    tool_calls: dict[int, dict] = {}
+
+    stream = await client.chat.completions.create(stream=True, **kwargs)
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            sys.stdout.write(delta.content)
+            sys.stdout.flush()
+            parts.append(delta.content)
+        for tc in delta.tool_calls or []:
+            slot = tool_calls.setdefault(
+                tc.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+            )
+            if tc.id:
+                slot["id"] = tc.id
+            if tc.function and tc.function.name:
+                slot["function"]["name"] += tc.function.name
+            if tc.function and tc.function.arguments:
+                slot["function"]["arguments"] += tc.function.arguments
+
+    msg = {"role": "assistant", "content": "".join(parts) or None}
+    if tool_calls:
+        msg["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+    return msg
+
+async def chat_with_tools(history: tuple[dict, deque], user_input: str) -> str:
     """
     Uses conversation history as memory.
     If the model calls web_search, we execute it and do a second call.
     """
     # Add user message to memory
-    history.append({"role": "user", "content": user_input})
-    history[:] = trim_history(history)
+    remember(history, {"role": "user", "content": user_input})
+    messages = history_messages(history)
 
     # First call: model may request tool(s)
-    resp = client.chat.completions.create(
+    msg = await stream_completion(
         model=MODEL,
-        messages=history,
+        messages=messages,
         tools=TOOLS,
         tool_choice="auto",
     )
 
-    msg = resp.choices[0].message
-
     # If no tool calls, finalize
-    if not msg.tool_calls:
-        assistant_text = (msg.content or "").strip()
-        history.append({"role": "assistant", "content": assistant_text})
-        history[:] = trim_history(history)
+    if not msg.get("tool_calls"):
+        assistant_text = (msg["content"] or "").strip()
+        remember(history, {"role": "assistant", "content": assistant_text})
         return assistant_text
 
-    # If tool calls exist, append the assistant tool-call message
-    history.append(msg)
+    # If tool calls exist, add the assistant tool-call message;
+    # the whole tool exchange goes into memory together with the answer
+    turn = [msg]
 
-    # Execute each tool call and append tool outputs
-    for tool_call in msg.tool_calls:
-        if tool_call.function.name == "web_search":
-            args = json.loads(tool_call.function.arguments)
-            results = web_search(args["query"], args.get("max_results", 5))
+    # Execute all tool calls concurrently and append tool outputs
+    # identical searches are coalesced: each unique (query, max_results) runs once
+    # and its result is fanned out to every tool_call_id that asked for it
+    unique: dict[tuple, list[str]] = {}
+    for tool_call in msg["tool_calls"]:
+        if tool_call["function"]["name"] == "web_search":
+            args = orjson.loads(tool_call["function"]["arguments"])
+            key = (args["query"], args.get("max_results", 5))
+            unique.setdefault(key, []).append(tool_call["id"])
+    all_results = await asyncio.gather(*(web_search_async(*key) for key in unique))
 
-            history.append(
+    for tool_call_ids, results in zip(unique.values(), all_results):
+        payload = orjson.dumps(results).decode()
+        for tool_call_id in tool_call_ids:
+            turn.append(
                 {
                     "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "content": json.dumps(results),
+                    "tool_call_id": tool_call_id,
+                    "content": payload,
                 }
             )
+    messages.extend(turn)
 
     # Second call: model uses tool results + memory to answer
-    final = client.chat.completions.create(
+    final = await stream_completion(
         model=MODEL,
-        messages=history,
+        messages=messages,
     )
 
-    assistant_text = final.choices[0].message.content.strip()
-    history.append({"role": "assistant", "content": assistant_text})
-    history[:] = trim_history(history)
+    assistant_text = (final["content"] or "").strip()
+    remember(history, *turn, {"role": "assistant", "content": assistant_text})
     return assistant_text
 
+def start_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Runs an event loop in a daemon thread for the API calls, so input() can
+    stay on the main thread (Ctrl-C at the prompt exits immediately) while
+    the warmup request proceeds in the background.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+async def warm_connection():
+    """
+    Opens the keep-alive connection to the API in the background so the
+    first real request doesn't pay the TCP+TLS handshake.
+    """
+    try:
+        # small request with a short timeout; only the open connection matters
+        await client.with_options(timeout=3).models.retrieve(MODEL)
+    except Exception:
+        pass
+
 def main():
     print("Web-enabled chatbot with memory started. Type 'quit', 'exit', 'bye' to stop.")
     print("Type '/reset' to clear memory.\n")
 
     # Memory starts with system message
-    history = [{"role": "system", "content": SYSTEM}]
+    history = new_history()
+
+    loop = start_event_loop()
+
+    def run(coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    warmup = None
 
     while True:
+        # fire-and-forget (once): warm the connection while the user types
+        if warmup is None:
+            warmup = asyncio.run_coroutine_threadsafe(warm_connection(), loop)
+
         user_input = input("You: ").strip()
 
         if user_input.lower() in {"quit", "exit", "bye"}:
@@ -144,15 +331,21 @@ def main():
             break
 
         if user_input.strip().lower() == "/reset":
-            history = [{"role": "system", "content": SYSTEM}]
+            history = new_history()
             print("Chatbot: Memory cleared.\n")
             continue
 
+        # the reply is streamed to stdout as it's generated
+        print("Chatbot: ", end="", flush=True)
         try:
-            reply = chat_with_tools(history, user_input)
-            print(f"Chatbot: {reply}\n")
+            run(chat_with_tools(history, user_input))
+            print("\n")
         except Exception as e:
-            print(f"Chatbot error: {e}\n")
+            print(f"\nChatbot error: {e}\n")
+
+    if warmup is not None:
+        warmup.cancel()
+    run(_http.aclose())
 
 if __name__ == "__main__":
     main()
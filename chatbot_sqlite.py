@@ -1,12 +1,21 @@
 import os
-import json
+import re
+import sys
+import asyncio
+import threading
+import itertools
+import time
 import sqlite3
-from datetime import datetime
+from collections import deque
 from uuid import uuid4
 from contextlib import contextmanager
 
 from dotenv import load_dotenv
-from openai import OpenAI
+import orjson
+import zstandard
+import httpx
+from cachetools import TTLCache
+from openai import AsyncOpenAI
 from ddgs import DDGS
 
 # -----------------------------
@@ -17,13 +26,33 @@ API_KEY = os.getenv("OPENAI_API_KEY")
 if not API_KEY:
     raise RuntimeError("OPENAI_API_KEY not found. Check your .env file.")
 
-client = OpenAI(api_key=API_KEY)
+# one long-lived HTTP client so every request reuses the same keep-alive (HTTP/2) connection
+_http = httpx.AsyncClient(
+    http2=True,
+    timeout=60,
+    limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=180),
+)
+client = AsyncOpenAI(api_key=API_KEY, http_client=_http)
 
 MODEL = "gpt-4o-mini"
 DB_PATH = os.path.join(os.path.dirname(__file__), "chat_memory.db")
 
-# how many recent non-system messages to send as context
-CONTEXT_MESSAGES = 24
+# approx. token budget for the context sent to the model (system + recent messages)
+CONTEXT_TOKENS = 6000
+
+# web_search snippets are cut to this length before being sent to the model
+SNIPPET_MAX_CHARS = 280
+
+# in-memory mirror of each chat's context window (system + recent messages within CONTEXT_TOKENS),
+# keyed by chat_id. Seeded on create_chat / begin_turn, kept in sync by add_message(s)
+CONTEXT_CACHE: dict[str, deque] = {}
+
+# messages that fall out of the context window are folded into a short summary,
+# stored as a second system message (one per chat)
+SUMMARY_HEADER = "Earlier in this conversation (summary):"
+SUMMARY_MAX_LINES = 20
+URL_RE = re.compile(r"https?://[^\s\"'<>)\]]+")
+SENTENCE_RE = re.compile(r"(.+?[.!?])(?=\s|$)")
 
 SYSTEM = (
     "You are a helpful assistant. "
@@ -50,6 +79,11 @@ TOOLS = [
     }
 ]
 
+INSERT_MSG_SQL = (
+    "INSERT INTO messages (chat_id, role, content, tool_call_id, tool_calls, created_at)"
+    " VALUES (?, ?, ?, ?, ?, ?)"
+)
+
 HELP_TEXT = """
 Commands:
   /new                 Start a new chat
@@ -57,6 +91,8 @@ Commands:
   /load <chat_id>      Load an existing chat by id
   /history             Print current chat history (user+assistant)
   /delete <chat_id>    Delete a chat (careful)
+  /replay [chat_id...] Regenerate last answers via the Batch API (default: current chat)
+  /collect <batch_id>  Store the results of a finished /replay batch as new answers
   /reset               Alias for /new
   /help                Show this help
   quit | exit | bye    Quit
@@ -65,50 +101,162 @@ Commands:
 # -----------------------------
 # Utils
 # -----------------------------
-def now_iso() -> str:
-    return datetime.utcnow().isoformat()
+def now_ms() -> int:
+    # unix epoch in milliseconds (stored as INTEGER)
+    return time.time_ns() // 1_000_000
+
+# tool outputs (search results JSON) are stored zstd-compressed
+_ZSTD = zstandard.ZstdCompressor(level=3)
+_DZSTD = zstandard.ZstdDecompressor()
+
+def pack_content(role: str, content: str) -> str | bytes:
+    if role == "tool":
+        return _ZSTD.compress(content.encode())
+    return content
+
+def unpack_content(content: str | bytes) -> str:
+    # rows written before compression was added are still plain text
+    if isinstance(content, bytes):
+        return _DZSTD.decompress(content).decode()
+    return content
+
+def first_sentence(text: str, limit: int = 160) -> str:
+    text = " ".join(text.split())
+    m = SENTENCE_RE.match(text)
+    return (m.group(1) if m else text)[:limit]
+
+def heuristic_summary(msgs: list[dict]) -> str:
+    """
+    No-LLM summary of evicted messages: first sentence of each user/assistant
+    message plus the URLs found in tool outputs, as bullet lines.
+    """
+    lines = []
+    urls: dict[str, None] = {}
+    for m in msgs:
+        content = m.get("content") or ""
+        if m["role"] == "user" and content.strip():
+            lines.append(f"- user asked: {first_sentence(content)}")
+        elif m["role"] == "assistant" and content.strip():
+            lines.append(f"- assistant answered: {first_sentence(content)}")
+        elif m["role"] == "tool":
+            urls.update(dict.fromkeys(URL_RE.findall(content)))
+    if urls:
+        lines.append("- sources: " + ", ".join(urls))
+    return "\n".join(lines)
+
+def merge_summary(old: str | None, new_lines: str) -> str:
+    lines = old.splitlines()[1:] if old else []
+    for line in new_lines.splitlines():
+        if line not in lines:
+            lines.append(line)
+    return "\n".join([SUMMARY_HEADER] + lines[-SUMMARY_MAX_LINES:])
+
+# single shared connection, opened once by init_db()
+_CONN: sqlite3.Connection | None = None
+
+# chats whose CONTEXT_CACHE entry was changed inside the open transaction;
+# dropped again if it rolls back, so the next turn reloads them from the DB
+_TXN_CHATS: set[str] = set()
+
+def connect_db() -> sqlite3.Connection:
+    global _CONN
+    if _CONN is None:
+        # autocommit mode; db() manages transactions explicitly
+        _CONN = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        _CONN.row_factory = sqlite3.Row
+        # small perf/safety tweaks (WAL keeps reads from blocking writes)
+        _CONN.execute("PRAGMA journal_mode=WAL;")
+        _CONN.execute("PRAGMA synchronous=NORMAL;")
+        _CONN.execute("PRAGMA foreign_keys=ON;")
+    return _CONN
+
+def close_db():
+    global _CONN
+    if _CONN is not None:
+        _CONN.execute("PRAGMA optimize")
+        _CONN.close()
+        _CONN = None
 
 @contextmanager
 def db():
-    c = sqlite3.connect(DB_PATH)
-    c.row_factory = sqlite3.Row
+    c = connect_db()
+    c.execute("BEGIN")
     try:
-        # small perf/safety tweaks
-        c.execute("PRAGMA journal_mode=WAL;")
-        c.execute("PRAGMA synchronous=NORMAL;")
-        c.execute("PRAGMA foreign_keys=ON;")
         yield c
-        c.commit()
+        c.execute("COMMIT")
+    except BaseException:
+        # a failed COMMIT (e.g. SQLITE_BUSY) leaves the transaction open
+        if c.in_transaction:
+            c.execute("ROLLBACK")
+        for chat_id in _TXN_CHATS:
+            CONTEXT_CACHE.pop(chat_id, None)
+        raise
     finally:
-        c.close()
+        _TXN_CHATS.clear()
 
 # -----------------------------
 # Web tool
 # -----------------------------
+# recent searches, so repeated tool queries don't hit the network again.
+# web_search runs in worker threads, hence the lock
+_SEARCH_CACHE: TTLCache = TTLCache(maxsize=256, ttl=600)
+_SEARCH_LOCK = threading.Lock()
+
+# one reusable DDGS client per worker thread: no per-call client setup,
+# and concurrent searches (asyncio.gather) never share an instance
+_DDGS_LOCAL = threading.local()
+
+def get_ddgs() -> DDGS:
+    ddgs = getattr(_DDGS_LOCAL, "ddgs", None)
+    if ddgs is None:
+        ddgs = _DDGS_LOCAL.ddgs = DDGS()
+    return ddgs
+
 def web_search(query: str, max_results: int = 5) -> list[dict]:
+    key = (query, max_results)
+    with _SEARCH_LOCK:
+        cached = _SEARCH_CACHE.get(key)
+    if cached is not None:
+        return [dict(r) for r in cached]
+
+    # compact results: every token here is paid for again in the second LLM call
     results = []
-    with DDGS() as ddgs:
-        for r in ddgs.text(query, max_results=max_results):
-            results.append(
-                {
-                    "title": r.get("title"),
-                    "url": r.get("href"),
-                    "snippet": r.get("body"),
-                }
-            )
+    seen: set[str] = set()
+    hits = get_ddgs().text(query, max_results=max_results)
+    for r in itertools.islice(hits, max_results):
+        url = (r.get("href") or "").strip()
+        if not url or url in seen:
+            continue
+        seen.add(url)
+        item = {"url": url}
+        title = (r.get("title") or "").strip()
+        if title:
+            item["title"] = title
+        snippet = " ".join((r.get("body") or "").split())[:SNIPPET_MAX_CHARS]
+        if snippet:
+            item["snippet"] = snippet
+        results.append(item)
+
+    with _SEARCH_LOCK:
+        _SEARCH_CACHE[key] = tuple(dict(r) for r in results)
     return results
 
+async def web_search_async(query: str, max_results: int = 5) -> list[dict]:
+    # DDGS is blocking, so run it in a worker thread to let searches overlap
+    return await asyncio.to_thread(web_search, query, max_results)
+
 # -----------------------------
 # DB schema
 # -----------------------------
 def init_db():
+    connect_db()
     with db() as c:
         c.execute("""
         CREATE TABLE IF NOT EXISTS chats (
             pk INTEGER PRIMARY KEY AUTOINCREMENT,
             id TEXT UNIQUE NOT NULL,
             title TEXT,
-            created_at TEXT NOT NULL
+            created_at INTEGER NOT NULL
         )
         """)
 
@@ -117,15 +265,52 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             chat_id TEXT NOT NULL,
             role TEXT NOT NULL CHECK(role IN ('system','user','assistant','tool')),
-            content TEXT NOT NULL,
+            content BLOB NOT NULL,
             tool_call_id TEXT,
-            created_at TEXT NOT NULL,
+            tool_calls TEXT,
+            superseded INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL,
+            FOREIGN KEY(chat_id) REFERENCES chats(id) ON DELETE CASCADE
+        )
+        """)
+        # older DBs: assistant tool-call messages (JSON) weren't stored
+        cols = {r["name"] for r in c.execute("PRAGMA table_info(messages)")}
+        if "tool_calls" not in cols:
+            c.execute("ALTER TABLE messages ADD COLUMN tool_calls TEXT")
+        # ... and answers replaced by /collect are kept, flagged instead of overwritten
+        if "superseded" not in cols:
+            c.execute("ALTER TABLE messages ADD COLUMN superseded INTEGER NOT NULL DEFAULT 0")
+
+        # submitted /replay batches: which message each chat ended on, and whether
+        # the results were already stored (so /collect is safe to repeat)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS replays (
+            batch_id TEXT NOT NULL,
+            chat_id TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            collected INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(batch_id, chat_id),
             FOREIGN KEY(chat_id) REFERENCES chats(id) ON DELETE CASCADE
         )
         """)
 
+        # also serves the context read (chat_id = ?, ORDER BY id DESC) as a backward scan
         c.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id ON messages(chat_id, id)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_chats_pk ON chats(pk)")
+        # human-readable timestamps for /chats (rows from older DBs hold ISO text already)
+        c.execute("""
+        CREATE VIEW IF NOT EXISTS chats_iso AS
+        SELECT pk, id, title,
+            CASE WHEN created_at GLOB '*-*' THEN created_at
+                 ELSE datetime(created_at / 1000, 'unixepoch') END AS created_at_iso
+        FROM chats
+        """)
+
+        # pk is the rowid, already indexed
+        c.execute("DROP INDEX IF EXISTS idx_chats_pk")
+
+    # refresh planner stats where they're missing or stale (cheap no-op otherwise);
+    # close_db() runs it again for the tables this session touched
+    connect_db().execute("PRAGMA optimize=0x10002")
 
 # -----------------------------
 # DB operations
@@ -135,73 +320,206 @@ def create_chat(title: str | None = None) -> str:
     with db() as c:
         c.execute(
             "INSERT INTO chats (id, title, created_at) VALUES (?, ?, ?)",
-            (chat_id, title, now_iso()),
-        )
-        c.execute(
-            "INSERT INTO messages (chat_id, role, content, tool_call_id, created_at) VALUES (?, 'system', ?, NULL, ?)",
-            (chat_id, SYSTEM, now_iso()),
+            (chat_id, title, now_ms()),
         )
+        c.execute(INSERT_MSG_SQL, (chat_id, "system", SYSTEM, None, None, now_ms()))
+    CONTEXT_CACHE[chat_id] = deque([{"role": "system", "content": SYSTEM}])
     return chat_id
 
-def set_chat_title_if_empty(chat_id: str, title: str):
+def set_chat_title_if_empty(c: sqlite3.Connection, chat_id: str, title: str):
     title = (title or "").strip()[:80]
     if not title:
         return
-    with db() as c:
-        row = c.execute("SELECT title FROM chats WHERE id = ?", (chat_id,)).fetchone()
-        if row and (row["title"] is None or row["title"].strip() == ""):
-            c.execute("UPDATE chats SET title = ? WHERE id = ?", (title, chat_id))
+    c.execute(
+        "UPDATE chats SET title = ? WHERE id = ? AND (title IS NULL OR TRIM(title) = '')",
+        (title, chat_id),
+    )
 
 def add_message(chat_id: str, role: str, content: str, tool_call_id: str | None = None):
     with db() as c:
-        c.execute(
-            "INSERT INTO messages (chat_id, role, content, tool_call_id, created_at) VALUES (?, ?, ?, ?, ?)",
-            (chat_id, role, content, tool_call_id, now_iso()),
-        )
+        c.execute(INSERT_MSG_SQL, (chat_id, role, pack_content(role, content), tool_call_id, None, now_ms()))
+        cache_append(c, chat_id, to_context_message(role, content, tool_call_id))
 
-def get_context_messages(chat_id: str) -> list[dict]:
+def add_messages(chat_id: str, rows: list[tuple]):
     """
-    Returns messages ready for OpenAI:
-      - first system message (one per chat)
-      - last CONTEXT_MESSAGES non-system messages
+    Inserts several (role, content, tool_call_id, tool_calls) rows in one transaction.
+    tool_calls is the assistant's tool-call list (stored as JSON), else None.
     """
     with db() as c:
-        sys_row = c.execute(
-            "SELECT role, content FROM messages WHERE chat_id = ? AND role = 'system' ORDER BY id ASC LIMIT 1",
-            (chat_id,),
-        ).fetchone()
-
-        rows = c.execute(
-            """
-            SELECT role, content, tool_call_id
-            FROM messages
-            WHERE chat_id = ? AND role != 'system'
-            ORDER BY id DESC
-            LIMIT ?
-            """,
-            (chat_id, CONTEXT_MESSAGES),
-        ).fetchall()
+        insert_messages(c, chat_id, rows)
+
+def insert_messages(c: sqlite3.Connection, chat_id: str, rows: list[tuple]):
+    # add_messages on the caller's transaction
+    ts = now_ms()
+    c.executemany(
+        INSERT_MSG_SQL,
+        [
+            (
+                chat_id,
+                role,
+                pack_content(role, content or ""),
+                tool_call_id,
+                orjson.dumps(tool_calls).decode() if tool_calls else None,
+                ts,
+            )
+            for role, content, tool_call_id, tool_calls in rows
+        ],
+    )
+    for row in rows:
+        cache_append(c, chat_id, to_context_message(*row))
+
+def to_context_message(
+    role: str, content: str, tool_call_id: str | None = None, tool_calls: list[dict] | None = None
+) -> dict:
+    if role == "tool":
+        return {"role": "tool", "tool_call_id": tool_call_id, "content": content}
+    if tool_calls:
+        # assistant message that requested the tool results following it
+        return {"role": "assistant", "content": content or None, "tool_calls": tool_calls}
+    return {"role": role, "content": content}
+
+def approx_tokens(m: dict) -> int:
+    # cheap token estimate (~4 chars per token), no tokenizer needed
+    args = sum(len(tc["function"]["arguments"]) for tc in m.get("tool_calls") or ())
+    return (len(m.get("content") or "") + len(m.get("role", "")) + args) // 4
+
+def trim_context(ctx: deque) -> list[dict]:
+    """
+    Drops the oldest non-system messages until the window fits CONTEXT_TOKENS
+    and returns them. System messages (prompt + summary) stay pinned and the
+    latest message is always kept.
+    """
+    pinned = []
+    while ctx and ctx[0]["role"] == "system":
+        pinned.append(ctx.popleft())
+    total = sum(approx_tokens(m) for m in pinned) + sum(approx_tokens(m) for m in ctx)
+    evicted = []
+    while len(ctx) > 1 and (total > CONTEXT_TOKENS or ctx[0]["role"] == "tool"):
+        # a leading tool result is useless without the call that produced it
+        m = ctx.popleft()
+        total -= approx_tokens(m)
+        evicted.append(m)
+    ctx.extendleft(reversed(pinned))
+    return evicted
+
+def store_summary(c: sqlite3.Connection, chat_id: str, ctx: deque, evicted: list[dict]):
+    """
+    Folds evicted messages into the chat's summary message (ctx[1]),
+    in memory and in the DB.
+    """
+    new_lines = heuristic_summary(evicted)
+    if not new_lines:
+        return
+    has_summary = len(ctx) > 1 and ctx[1]["role"] == "system"
+    summary = {"role": "system", "content": merge_summary(ctx[1]["content"] if has_summary else None, new_lines)}
+    if has_summary:
+        ctx[1] = summary
+    else:
+        ctx.insert(1, summary)
+
+    cur = c.execute(
+        """
+        UPDATE messages SET content = ?
+        WHERE id = (
+            SELECT id FROM messages WHERE chat_id = ? AND role = 'system' ORDER BY id ASC LIMIT 1 OFFSET 1
+        )
+        """,
+        (summary["content"], chat_id),
+    )
+    if cur.rowcount == 0:
+        c.execute(INSERT_MSG_SQL, (chat_id, "system", summary["content"], None, None, now_ms()))
 
-    msgs: list[dict] = []
-    if sys_row:
-        msgs.append({"role": "system", "content": sys_row["content"]})
+def cache_append(c: sqlite3.Connection, chat_id: str, m: dict):
+    """
+    Append to the cached context window, keeping the system messages pinned
+    at the front while older messages are summarized away.
+    """
+    ctx = CONTEXT_CACHE.get(chat_id)
+    if ctx is None:
+        # not loaded yet -> begin_turn reads it from the DB on the next turn
+        return
+    _TXN_CHATS.add(chat_id)
+    ctx.append(m)
+    evicted = trim_context(ctx)
+    if evicted:
+        store_summary(c, chat_id, ctx, evicted)
 
-    for r in reversed(rows):
-        if r["role"] == "tool":
-            msgs.append(
-                {"role": "tool", "tool_call_id": r["tool_call_id"], "content": r["content"]}
-            )
-        else:
-            msgs.append({"role": r["role"], "content": r["content"]})
+def load_context_messages(c: sqlite3.Connection, chat_id: str) -> list[dict]:
+    """
+    Reads the context window from the DB on the given connection
+    and (re)populates CONTEXT_CACHE with it.
+    """
+    ctx = deque(read_context_messages(c, chat_id))
+    evicted = trim_context(ctx)
+    if evicted:
+        store_summary(c, chat_id, ctx, evicted)
+    _TXN_CHATS.add(chat_id)
+    CONTEXT_CACHE[chat_id] = ctx
+    return list(ctx)
+
+def read_context_messages(c: sqlite3.Connection, chat_id: str) -> list[dict]:
+    """
+    Reads system prompt + summary and the newest messages that fit in
+    CONTEXT_TOKENS. Read-only: no cache or summary updates.
+    """
+    # system prompt + summary
+    sys_rows = c.execute(
+        "SELECT role, content FROM messages WHERE chat_id = ? AND role = 'system' ORDER BY id ASC LIMIT 2",
+        (chat_id,),
+    ).fetchall()
+
+    msgs: list[dict] = [{"role": "system", "content": r["content"]} for r in sys_rows]
+    budget = CONTEXT_TOKENS - sum(approx_tokens(m) for m in msgs)
+
+    # walk newest -> oldest and stop reading once the budget is used up
+    recent: list[dict] = []
+    for r in c.execute(
+        """
+        SELECT role, content, tool_call_id, tool_calls
+        FROM messages
+        WHERE chat_id = ? AND role != 'system' AND superseded = 0
+        ORDER BY id DESC
+        """,
+        (chat_id,),
+    ):
+        tool_calls = orjson.loads(r["tool_calls"]) if r["tool_calls"] else None
+        m = to_context_message(r["role"], unpack_content(r["content"]), r["tool_call_id"], tool_calls)
+        budget -= approx_tokens(m)
+        if budget < 0 and recent:
+            break
+        recent.append(m)
 
+    # tool results need the assistant tool-call message before them; rows from
+    # older DBs never stored it, so those results are left out
+    called: set[str] = set()
+    for m in reversed(recent):
+        if m["role"] == "tool" and m["tool_call_id"] not in called:
+            continue
+        called.update(tc["id"] for tc in m.get("tool_calls") or ())
+        msgs.append(m)
     return msgs
 
+def begin_turn(chat_id: str, user_input: str) -> list[dict]:
+    """
+    Stores the user message, titles the chat if untitled and returns the
+    context window -- all in a single transaction (one commit per turn).
+    """
+    with db() as c:
+        c.execute(INSERT_MSG_SQL, (chat_id, "user", user_input, None, None, now_ms()))
+        set_chat_title_if_empty(c, chat_id, user_input)
+        if chat_id not in CONTEXT_CACHE:
+            # cold load: the SELECTs already see the user message inserted above
+            return load_context_messages(c, chat_id)
+        cache_append(c, chat_id, to_context_message("user", user_input))
+
+    return list(CONTEXT_CACHE[chat_id])
+
 def list_chats(limit: int = 20):
     with db() as c:
         rows = c.execute(
             """
-            SELECT id, COALESCE(title,'(untitled)') AS title, created_at
-            FROM chats
+            SELECT id, COALESCE(title,'(untitled)') AS title, created_at_iso AS created_at
+            FROM chats_iso
             ORDER BY pk DESC
             LIMIT ?
             """,
@@ -213,9 +531,9 @@ def fetch_full_history(chat_id: str, limit: int = 200):
     with db() as c:
         rows = c.execute(
             """
-            SELECT role, content
+            SELECT role, content, superseded
             FROM messages
-            WHERE chat_id = ? AND role IN ('user','assistant')
+            WHERE chat_id = ? AND role IN ('user','assistant') AND tool_calls IS NULL
             ORDER BY id ASC
             LIMIT ?
             """,
@@ -226,63 +544,219 @@ def fetch_full_history(chat_id: str, limit: int = 200):
 def delete_chat(chat_id: str):
     with db() as c:
         c.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+    CONTEXT_CACHE.pop(chat_id, None)
 
 # -----------------------------
 # Chat logic (tools + SQLite memory)
 # -----------------------------
-def chat_turn(chat_id: str, user_input: str) -> str:
-    add_message(chat_id, "user", user_input)
-    set_chat_title_if_empty(chat_id, user_input)
+async def stream_completion(**kwargs) -> dict:
+    """
+    Streams a completion, echoing text to stdout as it arrives, and rebuilds
+    the final assistant message from the deltas as a plain dict: role, content
+    and -- only if the model called tools -- the minimal tool_calls list.
+    It can go straight back into the history without any SDK conversion.
+    """
+    parts: list[str] = []
+    tool_calls: dict[int, dict] = {}
 
-    messages = get_context_messages(chat_id)
+    stream = await client.chat.completions.create(stream=True, **kwargs)
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            sys.stdout.write(delta.content)
+            sys.stdout.flush()
+            parts.append(delta.content)
+        for tc in delta.tool_calls or []:
+            slot = tool_calls.setdefault(
+                tc.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+            )
+            if tc.id:
+                slot["id"] = tc.id
+            if tc.function and tc.function.name:
+                slot["function"]["name"] += tc.function.name
+            if tc.function and tc.function.arguments:
+                slot["function"]["arguments"] += tc.function.arguments
+
+    msg = {"role": "assistant", "content": "".join(parts) or None}
+    if tool_calls:
+        msg["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+    return msg
+
+async def chat_turn(chat_id: str, user_input: str) -> str:
+    messages = begin_turn(chat_id, user_input)
 
     # First call: may request web_search
-    resp = client.chat.completions.create(
+    msg = await stream_completion(
         model=MODEL,
         messages=messages,
         tools=TOOLS,
         tool_choice="auto",
     )
 
-    msg = resp.choices[0].message
-
     # No tool use -> reply
-    if not msg.tool_calls:
-        reply = (msg.content or "").strip()
+    if not msg.get("tool_calls"):
+        reply = (msg["content"] or "").strip()
         add_message(chat_id, "assistant", reply)
         return reply
 
-    # Tool(s) requested: append the assistant tool-call message to in-memory context
+    # Tool(s) requested: the assistant tool-call message goes into the context
+    # (and is stored below) ahead of the tool results that answer it
     messages.append(msg)
 
-    for tool_call in msg.tool_calls:
-        if tool_call.function.name == "web_search":
-            args = json.loads(tool_call.function.arguments)
-            results = web_search(args["query"], args.get("max_results", 5))
-            tool_payload = json.dumps(results)
-
-            # store tool output in DB for persistence
-            add_message(chat_id, "tool", tool_payload, tool_call_id=tool_call.id)
+    # run all searches concurrently
+    # identical searches are coalesced: each unique (query, max_results) runs once
+    # and its result is fanned out to every tool_call_id that asked for it
+    unique: dict[tuple, list[str]] = {}
+    for tool_call in msg["tool_calls"]:
+        if tool_call["function"]["name"] == "web_search":
+            args = orjson.loads(tool_call["function"]["arguments"])
+            key = (args["query"], args.get("max_results", 5))
+            unique.setdefault(key, []).append(tool_call["id"])
+    all_results = await asyncio.gather(*(web_search_async(*key) for key in unique))
+
+    tool_rows = []
+    for tool_call_ids, results in zip(unique.values(), all_results):
+        tool_payload = orjson.dumps(results).decode()
+        for tool_call_id in tool_call_ids:
+            # kept for persistence (stored together with the reply below)
+            tool_rows.append(("tool", tool_payload, tool_call_id, None))
 
             # provide tool output to model
             messages.append(
-                {"role": "tool", "tool_call_id": tool_call.id, "content": tool_payload}
+                {"role": "tool", "tool_call_id": tool_call_id, "content": tool_payload}
             )
 
     # Second call: model uses tool results
-    final = client.chat.completions.create(
+    final = await stream_completion(
         model=MODEL,
         messages=messages,
     )
 
-    reply = final.choices[0].message.content.strip()
-    add_message(chat_id, "assistant", reply)
+    reply = (final["content"] or "").strip()
+    add_messages(
+        chat_id,
+        [("assistant", msg["content"], None, msg["tool_calls"]), *tool_rows, ("assistant", reply, None, None)],
+    )
     return reply
 
+# -----------------------------
+# Batch replay (OpenAI Batch API: 50% cheaper, no rate-limit pressure)
+# -----------------------------
+def last_message_id(c: sqlite3.Connection, chat_id: str) -> int | None:
+    row = c.execute(
+        "SELECT id FROM messages WHERE chat_id = ? AND role != 'system' ORDER BY id DESC LIMIT 1",
+        (chat_id,),
+    ).fetchone()
+    return row["id"] if row else None
+
+def replay_request(c: sqlite3.Connection, chat_id: str) -> dict | None:
+    """
+    One Batch API request that regenerates the last answer of a chat:
+    its context window minus the trailing assistant reply. A chat whose last
+    answer used web_search keeps the tool-call message and its results.
+    Reads straight from the DB so replayed chats aren't pulled into CONTEXT_CACHE.
+    """
+    ctx = deque(read_context_messages(c, chat_id))
+    trim_context(ctx)
+    messages = list(ctx)
+    while messages and messages[-1]["role"] == "assistant" and not messages[-1].get("tool_calls"):
+        messages.pop()
+    if not messages or messages[-1]["role"] not in {"user", "tool"}:
+        return None
+    return {
+        "custom_id": chat_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": MODEL, "messages": messages},
+    }
+
+async def submit_batch_replay(chat_ids: list[str]) -> str | None:
+    """
+    Uploads a JSONL file with one request per chat and starts a batch.
+    Returns the batch id (results come back via collect_batch_replay).
+    """
+    with db() as c:
+        requests = [r for r in (replay_request(c, chat_id) for chat_id in dict.fromkeys(chat_ids)) if r]
+        last_ids = {r["custom_id"]: last_message_id(c, r["custom_id"]) for r in requests}
+    if not requests:
+        return None
+
+    jsonl = b"\n".join(orjson.dumps(r) for r in requests)
+    batch_file = await client.files.create(file=("replay.jsonl", jsonl), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+
+    with db() as c:
+        c.executemany(
+            "INSERT INTO replays (batch_id, chat_id, last_message_id) VALUES (?, ?, ?)",
+            [(batch.id, chat_id, last_id) for chat_id, last_id in last_ids.items()],
+        )
+    return batch.id
+
+async def collect_batch_replay(batch_id: str) -> tuple[str | None, int, int]:
+    """
+    Polls a replay batch once. When it's completed, each regenerated answer
+    is appended to its chat; the answer it replaces stays in the DB, marked
+    superseded and left out of the context. Chats that got new messages since
+    /replay are skipped.
+    Returns (batch status, stored replies, failed requests); status is None
+    when the batch is unknown or was already collected.
+    """
+    with db() as c:
+        pending = {
+            r["chat_id"]: r["last_message_id"]
+            for r in c.execute(
+                "SELECT chat_id, last_message_id FROM replays WHERE batch_id = ? AND collected = 0",
+                (batch_id,),
+            )
+        }
+    if not pending:
+        return None, 0, 0
+
+    batch = await client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        return batch.status, 0, 0
+
+    # failed requests only show up in the batch's error file, so there may be no output file at all
+    output = (await client.files.content(batch.output_file_id)).text if batch.output_file_id else ""
+    stored = skipped = 0
+    with db() as c:
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            result = orjson.loads(line)
+            chat_id = result["custom_id"]
+            response = result.get("response") or {}
+            if chat_id not in pending or response.get("status_code") != 200:
+                continue
+
+            row = c.execute(
+                "SELECT id, role FROM messages WHERE chat_id = ? AND role != 'system' ORDER BY id DESC LIMIT 1",
+                (chat_id,),
+            ).fetchone()
+            if row is None or row["id"] != pending[chat_id]:
+                skipped += 1  # chat moved on (or was deleted) since /replay
+                continue
+
+            reply = (response["body"]["choices"][0]["message"].get("content") or "").strip()
+            if row["role"] == "assistant":
+                c.execute("UPDATE messages SET superseded = 1 WHERE id = ?", (row["id"],))
+            CONTEXT_CACHE.pop(chat_id, None)  # reloaded from the DB on next use
+            insert_messages(c, chat_id, [("assistant", reply, None, None)])
+            stored += 1
+
+        c.execute("UPDATE replays SET collected = 1 WHERE batch_id = ?", (batch_id,))
+    return batch.status, stored, len(pending) - stored - skipped
+
 # -----------------------------
 # CLI
 # -----------------------------
-def handle_command(current_chat_id: str, raw: str) -> str | None:
+async def handle_command(current_chat_id: str, raw: str) -> str | None:
     """
     Returns:
       - new chat_id (if command changes it), else None
@@ -322,7 +796,8 @@ def handle_command(current_chat_id: str, raw: str) -> str | None:
         if not hist:
             print("(no messages yet)")
         for m in hist:
-            print(f"{m['role'].upper()}: {m['content']}")
+            label = m["role"].upper() + (" (superseded)" if m["superseded"] else "")
+            print(f"{label}: {m['content']}")
         print("--- End ---\n")
         return None
 
@@ -338,9 +813,53 @@ def handle_command(current_chat_id: str, raw: str) -> str | None:
             return new_id
         return None
 
+    if cmd == "/replay":
+        chat_ids = arg.split() or [current_chat_id]
+        batch_id = await submit_batch_replay(chat_ids)
+        if not batch_id:
+            print("Chatbot: Nothing to replay.\n")
+            return None
+        print(f"Chatbot: Replay batch submitted: {batch_id}")
+        print(f"Chatbot: Check it with /collect {batch_id}\n")
+        return None
+
+    if cmd == "/collect":
+        if not arg:
+            print("Chatbot: Usage: /collect <batch_id>\n")
+            return None
+        status, stored, failed = await collect_batch_replay(arg)
+        if status is None:
+            print(f"Chatbot: No pending replay batch {arg} (unknown or already collected).\n")
+        elif status == "completed":
+            print(f"Chatbot: Batch completed, stored {stored} replies, {failed} failed.\n")
+        else:
+            print(f"Chatbot: Batch status: {status}\n")
+        return None
+
     print("Chatbot: Unknown command. Type /help\n")
     return None
 
+def start_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Runs an event loop in a daemon thread for the API calls, so input() can
+    stay on the main thread (Ctrl-C at the prompt exits immediately) while
+    the warmup request proceeds in the background.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+async def warm_connection():
+    """
+    Opens the keep-alive connection to the API in the background so the
+    first real request doesn't pay the TCP+TLS handshake.
+    """
+    try:
+        # small request with a short timeout; only the open connection matters
+        await client.with_options(timeout=3).models.retrieve(MODEL)
+    except Exception:
+        pass
+
 def main():
     init_db()
 
@@ -349,7 +868,18 @@ def main():
     print("Type /help for commands.\n")
     print(f"Current chat_id: {chat_id}\n")
 
+    loop = start_event_loop()
+
+    def run(coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    warmup = None
+
     while True:
+        # fire-and-forget (once): warm the connection while the user types
+        if warmup is None:
+            warmup = asyncio.run_coroutine_threadsafe(warm_connection(), loop)
+
         user_input = input("You: ").strip()
 
         if user_input.lower() in {"quit", "exit", "bye"}:
@@ -357,16 +887,27 @@ def main():
             break
 
         if user_input.startswith("/"):
-            maybe_new = handle_command(chat_id, user_input)
+            try:
+                maybe_new = run(handle_command(chat_id, user_input))
+            except Exception as e:
+                print(f"Chatbot error: {e}\n")
+                continue
             if maybe_new:
                 chat_id = maybe_new
             continue
 
+        # the reply is streamed to stdout as it's generated
+        print("Chatbot: ", end="", flush=True)
         try:
-            reply = chat_turn(chat_id, user_input)
-            print(f"Chatbot: {reply}\n")
+            run(chat_turn(chat_id, user_input))
+            print("\n")
         except Exception as e:
-            print(f"Chatbot error: {e}\n")
+            print(f"\nChatbot error: {e}\n")
+
+    if warmup is not None:
+        warmup.cancel()
+    run(_http.aclose())
+    close_db()
 
 if __name__ == "__main__":
     main()